@@ -1,19 +1,13 @@
 from __future__ import annotations
 
+import functools
 import glob
 import os
-import pathlib
-import re
-import textwrap
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Literal, List, Tuple, Union, Optional
-from typing import NamedTuple
+from typing import Iterable, Literal, List, Tuple, Union, Optional
 
 import click
-import pyperclip
-import pytest
-import tiktoken
 
 # TODO: get rid of the handling of unclosed blocks. It's not worth the added complexity. Newer models will have much larger output limits or will be able to continue generating incomplete messages (or 'prefill', as Anthropic calls it).
 
@@ -23,10 +17,111 @@ YELLOW = "\033[93m"
 GREEN = "\033[92m"
 RESET = "\033[0m"
 
-enc = tiktoken.encoding_for_model("gpt-4o")
+# Sentinel used to split a path replacement field into prefix and suffix; it
+# just needs to never occur in a real field.
+_SENTINEL = "\x00__DIR2MD_SENTINEL__\x00"
+
 token_fudge_factor = 1.5
 
-class TextFile(NamedTuple):
+def _tokenizer_threads() -> int:
+    """Thread count for batched tokenization.
+
+    Set DIR2MD_TOKENIZER_THREADS=1 when running dir2md inside an outer thread
+    or process pool to avoid oversubscribing the machine. A malformed value
+    falls back to the default with a warning rather than breaking import.
+    """
+    default = min(8, os.cpu_count() or 1)
+    value = os.environ.get("DIR2MD_TOKENIZER_THREADS")
+    if value is None:
+        return default
+    # Warnings go to stderr: for the dir2md command, stdout is the generated
+    # markdown, and these fire at import time.
+    try:
+        threads = int(value)
+    except ValueError:
+        click.echo(f"{YELLOW}Warning: ignoring invalid DIR2MD_TOKENIZER_THREADS={value!r}.{RESET}", err=True)
+        return default
+    if threads < 1:
+        click.echo(f"{YELLOW}Warning: ignoring non-positive DIR2MD_TOKENIZER_THREADS={threads}.{RESET}", err=True)
+        return default
+    return threads
+
+
+_TOKENIZER_THREADS = _tokenizer_threads()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_enc():
+    """Loads the tokenizer on first use.
+
+    Importing tiktoken and loading the BPE table costs hundreds of
+    milliseconds; commands that never count tokens (e.g. --help) should not
+    pay for it at import time.
+    """
+    import tiktoken
+    return tiktoken.encoding_for_model("gpt-4o")
+
+
+def count_tokens(s: str) -> int:
+    """Counts the tokens in a single string.
+
+    Uses a count-only API when the installed tiktoken exposes one, avoiding the
+    allocation of a full token list that would be discarded immediately.
+    """
+    enc = _get_enc()
+    count_ordinary = getattr(getattr(enc, "_core_bpe", None), "count_ordinary", None)
+    if count_ordinary is not None:
+        return count_ordinary(s)
+    return len(enc.encode_ordinary(s))
+
+
+def batch_token_counts(texts: List[str]) -> List[int]:
+    """Counts tokens for many strings with a single batched encode call.
+
+    A single `encode_ordinary_batch` call crosses the Python/Rust boundary once
+    and lets tiktoken parallelize internally, instead of paying the FFI cost
+    per string.
+    """
+    if not texts:
+        return []
+    tokens = _get_enc().encode_ordinary_batch(texts, num_threads=min(_TOKENIZER_THREADS, len(texts)))
+    return [len(t) for t in tokens]
+
+def _decide_ticks(text: str) -> str:
+    """Picks a fence long enough that no line inside `text` can close it early.
+
+    A single pass over the newlines in `text` finds the longest run of
+    backticks that opens a (possibly whitespace-prefixed) line, replacing the
+    old escalation loop that re-scanned the whole text per extra backtick.
+    """
+    # Most source files contain no backticks at all; one substring test
+    # settles those without visiting any newline.
+    if "`" not in text:
+        return "```"
+    max_run = 0
+    n = len(text)
+    i = 0
+    while True:
+        j = text.find("\n", i)
+        if j < 0:
+            break
+        k = j + 1
+        while k < n and text[k].isspace():
+            k += 1
+        run = 0
+        while k + run < n and text[k + run] == "`":
+            run += 1
+        if run > max_run:
+            max_run = run
+        i = j + 1
+    return "`" * max(3, max_run + 1)
+
+
+# A slotted dataclass instead of a NamedTuple: no tuple descriptor
+# indirection on attribute access, and md2dir can update text/token_count
+# in place when the last block is unclosed.
+@dataclass(slots=True)
+class TextFile:
     text: str
     path: str
     start: int = 0
@@ -35,60 +130,60 @@ class TextFile(NamedTuple):
 
 
 def default_formatter(text_file: TextFile, path_location: Literal["above", "below"], include_token_count: bool = False) -> str:
-    r = ""
+    # Collect the chunks and join once rather than growing a string.
+    parts: list[str] = []
+    # Decide how many ticks to use
+    ticks = _decide_ticks(text_file.text)
+    language, comment_prefix = _ext_info(text_file.path)
     if path_location == "above":
-        # Yield the relative path to the file
-        r += f"{text_file.path}\n\n"
-        # Yield the code block
-        # Decide how many ticks to use
-        ticks = "```"
-        while re.search(rf"\n\s*{ticks}", text_file.text):
-            ticks += "`"
-        language = infer_language(text_file.path)
-        if include_token_count:
-            # Add the custom attribute for the token count
-            r += f"{ticks}{language} tokens={int(text_file.token_count * token_fudge_factor)}\n"
-        else:
-            r += f"{ticks}{language}\n"
-        r += text_file.text
-        r += f"{ticks}\n\n"
-    else:
-        # For path_location == "below"
-        # Yield the code block
-        ticks = "```"
-        while re.search(rf"\n\s*{ticks}", text_file.text):
-            ticks += "`"
-        language = infer_language(text_file.path)
+        # The relative path to the file goes above the code block
+        parts.append(f"{text_file.path}\n\n")
+    if include_token_count:
         # Add the custom attribute for the token count
-        if include_token_count:
-            r += f"{ticks}{language} tokens={int(text_file.token_count * token_fudge_factor)}\n"
-        else:
-            r += f"{ticks}{language}\n"
-        comment_prefix = comment_prefix_for_language(language)
-        r += f"{comment_prefix} {text_file.path}\n"
-        r += text_file.text
-        r += f"{ticks}\n\n"
-    return r
+        parts.append(f"{ticks}{language} tokens={int(text_file.token_count * token_fudge_factor)}\n")
+    else:
+        parts.append(f"{ticks}{language}\n")
+    if path_location != "above":
+        # The path goes below the opening fence, as a comment
+        parts.append(f"{comment_prefix} {text_file.path}\n")
+    parts.append(text_file.text)
+    parts.append(f"{ticks}\n\n")
+    return "".join(parts)
+
+
+# Add more mappings as needed
+_EXT_TO_LANG = {
+    ".py": "python",
+    ".rs": "rust",
+}
+
+# Add more mappings as needed
+_LANG_TO_COMMENT_PREFIX = {
+    "python": "#",
+    "rust": "//",
+}
 
 
+# Derived from the tables above so the formatter can resolve language and
+# comment prefix with a single lookup.
+_EXT_INFO = {
+    ext: (language, _LANG_TO_COMMENT_PREFIX.get(language, ""))
+    for ext, language in _EXT_TO_LANG.items()
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _ext_info(path: str) -> tuple[str, str]:
+    return _EXT_INFO.get(os.path.splitext(path)[1].lower(), ("", ""))
+
+
+@functools.lru_cache(maxsize=1024)
 def infer_language(path: str) -> str:
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
-    if ext == ".py":
-        return "python"
-    elif ext == ".rs":
-        return "rust"
-    # Add more mappings as needed
-    return ""
+    return _EXT_TO_LANG.get(os.path.splitext(path)[1].lower(), "")
 
 
 def comment_prefix_for_language(language: str) -> str:
-    if language == "python":
-        return "#"
-    elif language == "rust":
-        return "//"
-    # Add more mappings as needed
-    return ""
+    return _LANG_TO_COMMENT_PREFIX.get(language, "")
 
 
 @dataclass
@@ -97,107 +192,190 @@ class ParseResult:
     last_code_block_is_unclosed: bool
 
 
+def _format_error_message(start_line: int, code_block: str, path_replacement_field: str) -> str:
+    # TODO: fix this
+    # - don't hardcode the language name
+    # - pass this function the full lines and let it choose what to show
+    error_message = f"{RED}error: Could not find a path for code block{RESET}\n"
+    error_message += f"Error at line {start_line + 1}:6\n"
+    error_message += f" |\n"
+    error_message += f"{start_line + 1: >3} | {code_block.splitlines()[0]}\n"
+    error_message += f" | {RED}^^^^^{RESET} {YELLOW}Expected a commented path above or below the code block:{RESET}\n\n"
+
+    error_message += f" | {YELLOW}Option 1: Add a commented path above the code block start{RESET}\n"
+    error_message += f" |\n"
+    error_message += f"{GREEN}+{RESET} {start_line: >2} | {path_replacement_field} {YELLOW}<--- Add a path here{RESET}\n"
+    error_message += f" {start_line + 1: >3} | ```python\n"
+    error_message += f" {start_line + 2: >3} | {code_block.splitlines()[0]}\n"
+    error_message += f" {start_line + 3: >3} | ```\n\n"
+
+    error_message += f" | {YELLOW}Option 2: Add a commented path below the code block start{RESET}\n"
+    error_message += f" |\n"
+    error_message += f" {start_line: >3} | ```python\n"
+    error_message += f"{GREEN}+{RESET} {start_line + 1: >2} | # {path_replacement_field} {YELLOW}<--- Add a path here as a comment{RESET}\n"
+    error_message += f" {start_line + 2: >3} | {code_block.splitlines()[0]}\n"
+    error_message += f" {start_line + 3: >3} | ```\n"
+
+    return error_message
+
+
+def _body(s: str, body_start: int, body_end: int, first_end: int, fb_nl: int, below_matched: bool) -> str:
+    """Slices a block body out of `s`, dropping the matched path-comment line."""
+    if below_matched:
+        if fb_nl == -1:
+            return ""
+        rest = s[first_end + 1:body_end]
+        # The splitlines()/join round trip this replaced dropped one
+        # trailing newline from the stripped body (a blank line before the
+        # closing fence); keep that behavior.
+        return rest[:-1] if rest.endswith("\n") else rest
+    return s[body_start:body_end]
+
+
 def default_parser(s: str, path_replacement_field: str = "{}", path_location: Literal["above", "below"] = "below",
     ignore_missing_path: bool = False) -> ParseResult:
+    # Fast path: no opening fence anywhere means no code blocks, so skip the
+    # whole scan (one memchr-backed substring test).
+    if "```" not in s:
+        return ParseResult([], False)
+
+    # Normalize newlines up front (clipboard text on Windows arrives with
+    # CRLF) so every find/count below can assume "\n".
+    if "\r" in s:
+        s = s.replace("\r\n", "\n").replace("\r", "\n")
+
     def _find_path_above(text: str) -> str:
-        lines = text.splitlines()
-        if lines and path_replacement_field.format(lines[-1].strip()):
-            return lines[-1].strip()
+        # `text` is the single line immediately above the fence, so a strip is
+        # all that's needed -- no splitlines() list, no regex.
+        candidate = text.strip()
+        if candidate and path_replacement_field.format(candidate):
+            return candidate
         return ""
 
-    def _find_path_below(code: str, language: str) -> tuple[str, str]:
+    # The replacement-field prefix is loop-invariant: compute it once with a
+    # fixed sentinel instead of formatting a fresh uuid4() per code block.
+    try:
+        path_replacement_field_prefix = path_replacement_field.format(_SENTINEL).split(_SENTINEL)[0]
+    except IndexError:
+        path_replacement_field_prefix = path_replacement_field
+
+    def _match_path_below(first_line: str, language: str) -> Optional[str]:
+        # Only the first body line can carry the below-style path comment;
+        # a match means that line is stripped from the body.
         comment_prefix = comment_prefix_for_language(language)
-        lines = code.splitlines()
-        random_string = str(uuid.uuid4())
-        try:
-            path_replacement_field_prefix = path_replacement_field.format(random_string).split(random_string)[0]
-        except IndexError:
-            path_replacement_field_prefix = path_replacement_field
-        if lines and lines[0].startswith(f"{comment_prefix} {path_replacement_field_prefix}"):
-            path = lines[0][len(comment_prefix) + 1:].strip()
-            code = "\n".join(lines[1:])
-            return path, code
-        return "", code
-
-    def _format_error_message(start_line: int, code_block: str, path_replacement_field: str) -> str:
-        # TODO: fix this
-        # - don't hardcode the language name
-        # - pass this function the full lines and let it choose what to show
-        error_message = f"{RED}error: Could not find a path for code block{RESET}\n"
-        error_message += f"Error at line {start_line + 1}:6\n"
-        error_message += f" |\n"
-        error_message += f"{start_line + 1: >3} | {code_block.splitlines()[0]}\n"
-        error_message += f" | {RED}^^^^^{RESET} {YELLOW}Expected a commented path above or below the code block:{RESET}\n\n"
-
-        error_message += f" | {YELLOW}Option 1: Add a commented path above the code block start{RESET}\n"
-        error_message += f" |\n"
-        error_message += f"{GREEN}+{RESET} {start_line: >2} | {path_replacement_field} {YELLOW}<--- Add a path here{RESET}\n"
-        error_message += f" {start_line + 1: >3} | ```python\n"
-        error_message += f" {start_line + 2: >3} | {code_block.splitlines()[0]}\n"
-        error_message += f" {start_line + 3: >3} | ```\n\n"
-
-        error_message += f" | {YELLOW}Option 2: Add a commented path below the code block start{RESET}\n"
-        error_message += f" |\n"
-        error_message += f" {start_line: >3} | ```python\n"
-        error_message += f"{GREEN}+{RESET} {start_line + 1: >2} | # {path_replacement_field} {YELLOW}<--- Add a path here as a comment{RESET}\n"
-        error_message += f" {start_line + 2: >3} | {code_block.splitlines()[0]}\n"
-        error_message += f" {start_line + 3: >3} | ```\n"
-
-        return error_message
-
-    code_blocks = []
-    lines = s.splitlines()
-    print(f"Parsing {len(lines)} lines")
-    i = 0
+        if first_line and first_line.startswith(f"{comment_prefix} {path_replacement_field_prefix}"):
+            return first_line[len(comment_prefix) + 1:].strip()
+        return None
+
+    # Structure-of-arrays accumulation: parallel path/code lists feed the
+    # batched tokenizer directly, with TextFile tuples built only at the end.
+    block_paths: list[str] = []
+    block_codes: list[str] = []
+    n = len(s)
+    line_count = s.count("\n") + (0 if not s or s.endswith("\n") else 1)
+    print(f"Parsing {line_count} lines")
+    # Jump from fence to fence with str.find instead of visiting every line.
+    # Line numbers are only needed for error messages, so they are computed
+    # lazily by counting newlines up to the offending fence.
+    pos = 0
     missing_path_count = 0
     last_code_block_is_unclosed = False
-    while i < len(lines):
-        line = lines[i]
-        if line.startswith("```"):
-            start = i
-            ticks = line[:len(line) - len(line.lstrip("`"))]
-            rest = line[len(ticks):].strip()
-            attributes = rest.split(" ")
-            if len(attributes) > 0:
-                language = attributes[0]
-            else:
-                language = ""
-            i += 1
-            while True:
-                if i >= len(lines):
-                    break
-                if lines[i].startswith(ticks):
-                    i += 1
-                    break
-                i += 1
-
-            code = "\n".join(lines[start + 1:i - 1])
-
-            if path_location == "above" and start > 0:
-                above_text = lines[start - 1]
-                path = _find_path_above(above_text)
-                if not path:
-                    path, code = _find_path_below(code, language)
+    while pos < n:
+        if s.startswith("```", pos):
+            fence_pos = pos
+        else:
+            found = s.find("\n```", pos)
+            if found == -1:
+                break
+            fence_pos = found + 1
+        nl = s.find("\n", fence_pos)
+        line_end = nl if nl != -1 else n
+        line = s[fence_pos:line_end]
+        ticks = line[:len(line) - len(line.lstrip("`"))]
+        rest = line[len(ticks):].strip()
+        attributes = rest.split(" ")
+        if len(attributes) > 0:
+            language = attributes[0]
+        else:
+            language = ""
+        # Jump straight to the closing fence with one find: a closing line
+        # is exactly a "\n" followed by the tick run. `prev_start` is the
+        # start of the closing fence line, or of the document's final line
+        # when the block is unclosed.
+        body_start = line_end + 1
+        cur = body_start
+        prev_start = fence_pos
+        closed = False
+        if nl != -1:
+            close_nl = s.find("\n" + ticks, nl)
+            if close_nl != -1:
+                closed = True
+                prev_start = close_nl + 1
+                close_end = s.find("\n", prev_start)
+                cur = (close_end if close_end != -1 else n) + 1
             else:
-                path, code = _find_path_below(code, language)
-                if not path and start > 0:
-                    above_text = lines[start - 1]
-                    path = _find_path_above(above_text)
-            if not path:
-                missing_path_count += 1
-                if not ignore_missing_path:
-                    raise ValueError(_format_error_message(start, code, path_replacement_field))
-                else:
-                    if i == len(lines) and not lines[i - 1].startswith(ticks):
-                        last_code_block_is_unclosed = True
-            token_count = len(enc.encode(code))
-            code_blocks.append(TextFile(text=code, path=path, token_count=token_count))
+                last = n - 1 if s.endswith("\n") else n
+                prev_start = s.rfind("\n", 0, last) + 1
+                cur = n
+
+        # The body spans [body_start, body_end); the line at `prev_start`
+        # (closing fence, or final line when unclosed) is excluded. Only the
+        # first body line is needed to decide the path, so the full body is
+        # sliced out lazily -- skipped blocks never materialize it.
+        body_end = prev_start - 1 if prev_start > body_start else body_start
+        fb_nl = s.find("\n", body_start, body_end)
+        first_end = fb_nl if fb_nl != -1 else body_end
+        first_line = s[body_start:first_end]
+
+        # The line immediately above the fence, plucked with rfind rather
+        # than tracked for every line scanned.
+        if fence_pos > 0:
+            above_text = s[s.rfind("\n", 0, fence_pos - 1) + 1:fence_pos - 1]
         else:
-            i += 1
+            above_text = ""
+
+        below_matched = False
+        path = ""
+        if path_location == "above" and fence_pos > 0:
+            path = _find_path_above(above_text)
+        if not path:
+            below = _match_path_below(first_line, language)
+            if below is not None:
+                below_matched = True
+                path = below
+        if not path and path_location != "above" and fence_pos > 0:
+            path = _find_path_above(above_text)
+        if not path:
+            missing_path_count += 1
+            if not ignore_missing_path:
+                start_line_no = s.count("\n", 0, fence_pos)
+                code = _body(s, body_start, body_end, first_end, fb_nl, below_matched)
+                raise ValueError(_format_error_message(start_line_no, code, path_replacement_field))
+            else:
+                # Skip the block: don't keep it (or tokenize it) when it is
+                # only going to be discarded. A skipped block never enters
+                # the result list, so it must not mark the result as ending
+                # in an unclosed block either -- md2dir's unclosed handling
+                # mutates code_blocks[-1]. Kept blocks never set the flag:
+                # the scanner already drops the partial final line of an
+                # unclosed block, so flagging it would make omit_last_line
+                # drop a second, complete line.
+                pos = cur
+                continue
+        block_paths.append(path)
+        block_codes.append(_body(s, body_start, body_end, first_end, fb_nl, below_matched))
+        pos = cur
 
     if missing_path_count > 0 and ignore_missing_path:
         print(f"{YELLOW}Warning: Skipped {missing_path_count} code blocks due to missing paths.{RESET}")
 
+    # Tokenize all blocks at once rather than once per block.
+    token_counts = batch_token_counts(block_codes)
+    code_blocks = [
+        TextFile(text=code, path=path, token_count=token_count)
+        for path, code, token_count in zip(block_paths, block_codes, token_counts)
+    ]
+
     return ParseResult(code_blocks, last_code_block_is_unclosed)
 
 
@@ -212,69 +390,141 @@ def parse_file_arg(arg: str) -> Tuple[str, Optional[str]]:
         return arg, None
 
 
-def parse_line_specification(line_spec: str):
-    class X:
-        def __getitem__(self, key):
-            return key
+@functools.lru_cache(maxsize=128)
+def parse_line_specification(line_spec: str) -> List[Union[int, slice]]:
+    """Parses '[a:b:c]', '[i]' or '[[i, j, k:l, ...]]' into ints and slices.
+
+    Hand-rolled: the old eval()-based version paid a full compile/exec per
+    file argument, and could not express slices inside the list form.
+    """
+    def item(token: str) -> Union[int, slice]:
+        if ":" in token:
+            parts = token.split(":")
+            if len(parts) > 3:
+                raise ValueError(f"too many ':' in {token!r}")
+            return slice(*(int(p) if p.strip() else None for p in parts))
+        return int(token)
 
-    x = X()
     try:
-        # Using eval is generally unsafe, but in this specific case,
-        # we control the input and only allow indexing operations.
-        # It's still recommended to avoid eval if a safer alternative exists.
-        result = eval(f"x{line_spec}")  # Evaluate x[line_spec]
-        if isinstance(result, tuple):  # Handle slices (a, b) format
-            return [slice(*result)]  # Convert to slice object
-        elif isinstance(result, list):
-            return result
-        elif isinstance(result, slice | int):
-            return [result]
-        else:
-            raise ValueError(f"Invalid line specification: {line_spec}. Result: {result}.")
-    except (SyntaxError, TypeError, NameError, IndexError) as e:
+        spec = line_spec.strip()
+        if len(spec) < 2 or spec[0] != "[" or spec[-1] != "]":
+            raise ValueError("expected '[...]'")
+        inner = spec[1:-1].strip()
+        if inner.startswith("[") and inner.endswith("]"):
+            # List form: a mix of indices and ranges.
+            body = inner[1:-1].strip()
+            return [item(token) for token in body.split(",")] if body else []
+        if "," in inner:
+            # Bare tuple form: '[a, b]' behaves like a slice, as 'x[a, b]' did.
+            return [slice(*(int(p) for p in inner.split(",")))]
+        return [item(inner)]
+    except (ValueError, TypeError) as e:
         raise ValueError(f"Invalid line specification: {line_spec} - {e}")
 
 
-def dir2md_cli(
+def _slurp(file_path: str) -> str:
+    """Reads a whole file through the raw fd: one open, one sized read.
+
+    Skips the buffered text layer; newlines are normalized afterwards to match
+    what universal-newline text mode would have produced.
+    """
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size) if size else b""
+        while len(data) < size:
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        os.close(fd)
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _read_file(item: Tuple[str, Optional[str]]) -> Tuple[str, str]:
+    """Reads one file, applying an optional line specification."""
+    file_path, line_specification = item
+    # Opening directly (instead of an os.path.isfile pre-check) saves a stat
+    # syscall per file; a missing or non-regular path surfaces the same error.
+    try:
+        if line_specification:
+            with open(file_path, "r") as code_file:
+                lines = code_file.readlines()
+            indices_or_slices = parse_line_specification(line_specification)
+            selected_lines = []
+            for idx in indices_or_slices:
+                if isinstance(idx, slice):
+                    selected_lines.extend(lines[idx])
+                else:
+                    try:
+                        selected_lines.append(lines[idx])
+                    except IndexError:
+                        continue
+            code = ''.join(selected_lines)
+        else:
+            # No ranges requested: slurp the file in one read instead of
+            # building a list of lines and rejoining it.
+            code = _slurp(file_path)
+    except (FileNotFoundError, IsADirectoryError):
+        raise FileNotFoundError(f"File {file_path} not found")
+    if not code.endswith("\n"):
+        code += "\n"
+    return file_path, code
+
+
+def _render_markdown(
     files: List[str], no_glob: bool,
-    path_replacement_field: str, path_location: Literal["above", "below"]
-) -> None:
-    """Converts a directory of files to a markdown document."""
+    path_replacement_field: str, path_location: Literal["above", "below"],
+    include_token_count: bool, jobs: Optional[int] = None
+) -> str:
+    """Shared pipeline behind dir2md and dir2md_cli."""
+    if jobs is not None and jobs < 1:
+        raise ValueError(f"jobs must be a positive integer, got {jobs}")
     if isinstance(files, str):
         files = [files]
 
-    output = []
+    # Pass 1: resolve globs, then read every file through a thread pool.
+    # Reads release the GIL, so overlapping them hides per-file I/O latency;
+    # ThreadPoolExecutor.map keeps the output order deterministic.
+    to_read: list[Tuple[str, Optional[str]]] = []
     for file_arg in files:
         filename, line_specification = parse_file_arg(file_arg)
         if not no_glob:
-            file_paths = glob.glob(filename)
+            # iglob yields matches lazily instead of materializing the full
+            # match list up front.
+            file_paths: Iterable[str] = glob.iglob(filename)
         else:
-            file_paths = [filename]
+            file_paths = (filename,)
         for file_path in file_paths:
-            if not os.path.isfile(file_path):
-                raise FileNotFoundError(f"File {file_path} not found")
-            with open(file_path, "r") as code_file:
-                lines = code_file.readlines()
-                if line_specification:
-                    indices_or_slices = parse_line_specification(line_specification)
-                    selected_lines = []
-                    for idx in indices_or_slices:
-                        if isinstance(idx, slice):
-                            selected_lines.extend(lines[idx])
-                        else:
-                            try:
-                                selected_lines.append(lines[idx])
-                            except IndexError:
-                                continue
-                    code = ''.join(selected_lines)
-                else:
-                    code = ''.join(lines)
-                if not code.endswith("\n"):
-                    code += "\n"
-                token_count = len(enc.encode(code))
-                output.append(default_formatter(TextFile(path=file_path, text=code, token_count=token_count), path_location=path_location))
+            to_read.append((file_path, line_specification))
+    pending: list[tuple[str, str]] = []
+    if to_read:
+        with ThreadPoolExecutor(max_workers=min(jobs if jobs is not None else 32, len(to_read))) as executor:
+            pending = list(executor.map(_read_file, to_read))
+    # Pass 2: tokenize everything in one batched call (only when the counts
+    # will actually be printed -- BPE over whole files is the dominant cost
+    # of the tool), then format.
+    if include_token_count:
+        token_counts = batch_token_counts([code for _, code in pending])
+    else:
+        token_counts = [0] * len(pending)
+    output = [
+        default_formatter(TextFile(path=file_path, text=code, token_count=token_count),
+            path_location=path_location, include_token_count=include_token_count)
+        for (file_path, code), token_count in zip(pending, token_counts)
+    ]
     # Join all formatted outputs and remove trailing newlines
-    click.echo(("".join(output)).rstrip())
+    return ("".join(output)).rstrip()
+
+
+def dir2md_cli(
+    files: List[str], no_glob: bool,
+    path_replacement_field: str, path_location: Literal["above", "below"],
+    include_token_count: bool = False, jobs: Optional[int] = None
+) -> None:
+    """Converts a directory of files to a markdown document."""
+    click.echo(_render_markdown(files, no_glob, path_replacement_field, path_location, include_token_count, jobs))
 
 
 @click.command(name="dir2md")
@@ -283,60 +533,33 @@ def dir2md_cli(
 @click.option('--path-replacement-field', default="{}", help='The pattern to use for identifying the file path.')
 @click.option('--path-location', default="below", type=click.Choice(['above', 'below']),
     help='The location of the file path relative to the code block.')
+@click.option('--include-token-count', is_flag=True, default=False,
+    help='Annotate each code block with its token count.')
+@click.option('--jobs', type=click.IntRange(min=1), default=None,
+    help='Number of parallel file-read threads (default: min(32, file count)).')
 def dir2md_command(
     files: list[str], no_glob: bool,
-    path_replacement_field: str, path_location: Literal["above", "below"]
+    path_replacement_field: str, path_location: Literal["above", "below"],
+    include_token_count: bool, jobs: Optional[int]
 ) -> None:
     """Converts a directory of files to a markdown document."""
     dir2md_cli(
         files=files,
         no_glob=no_glob,
         path_replacement_field=path_replacement_field,
-        path_location=path_location
+        path_location=path_location,
+        include_token_count=include_token_count,
+        jobs=jobs
     )
 
 
 def dir2md(
     files: List[str], no_glob: bool = False,
-    path_replacement_field: str = "{}", path_location: Literal["above", "below"] = "below"
+    path_replacement_field: str = "{}", path_location: Literal["above", "below"] = "below",
+    include_token_count: bool = False, jobs: Optional[int] = None
 ) -> str:
     """Converts a directory of files to a markdown document."""
-    if isinstance(files, str):
-        files = [files]
-
-    output = []
-    for file_arg in files:
-        filename, line_specification = parse_file_arg(file_arg)
-        if not no_glob:
-            file_paths = glob.glob(filename)
-        else:
-            file_paths = [filename]
-        for file_path in file_paths:
-            if not os.path.isfile(file_path):
-                raise FileNotFoundError(f"File {file_path} not found")
-            with open(file_path, "r") as code_file:
-                lines = code_file.readlines()
-                if line_specification:
-                    indices_or_slices = parse_line_specification(line_specification)
-                    selected_lines = []
-                    for idx in indices_or_slices:
-                        if isinstance(idx, slice):
-                            selected_lines.extend(lines[idx])
-                        else:
-                            try:
-                                selected_lines.append(lines[idx])
-                            except IndexError:
-                                continue
-                    code = ''.join(selected_lines)
-                else:
-                    code = ''.join(lines)
-                if not code.endswith("\n"):
-                    code += "\n"
-                token_count = len(enc.encode(code))
-                output.append(default_formatter(TextFile(path=file_path, text=code, token_count=token_count), path_location=path_location))
-
-    # Join all formatted outputs and remove trailing newlines
-    return ("".join(output)).rstrip()
+    return _render_markdown(files, no_glob, path_replacement_field, path_location, include_token_count, jobs)
 
 
 @click.command(name="md2dir")
@@ -359,6 +582,7 @@ def md2dir_cli(
         raise click.UsageError("You must specify either --paste or --path.")
 
     if paste:
+        import pyperclip
         text = pyperclip.paste()
     elif path:
         with open(path, 'r') as f:
@@ -392,7 +616,7 @@ def md2dir(
                 pass
             case "omit_last_line":
                 parse_result.code_blocks[-1].text = "\n".join(parse_result.code_blocks[-1].text.splitlines()[:-1])
-                parse_result.code_blocks[-1].token_count = len(enc.encode(parse_result.code_blocks[-1].text))
+                parse_result.code_blocks[-1].token_count = count_tokens(parse_result.code_blocks[-1].text)
             case "skip":
                 parse_result.code_blocks.pop()
             case "error":
@@ -403,24 +627,38 @@ def md2dir(
     return parse_result
 
 
+def _existing_file_set(output_dir: str) -> set[str]:
+    """Snapshots the files under `output_dir` as paths relative to it.
+
+    One walk of the output tree replaces a stat syscall per file when
+    classifying targets as new or existing.
+    """
+    existing = set()
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            existing.add(os.path.relpath(os.path.join(root, name), output_dir))
+    return existing
+
+
 def save_dir(files: list[TextFile], output_dir: str, yes: bool = False) -> None:
     if files and not yes:
         filenames = [file.path for file in files]
+        existing = _existing_file_set(output_dir)
+        # Classify directories and files in one pass over the filenames.
         new_directories = []
+        seen_directories = set()
+        new_files = []
+        existing_files = []
         for filename in filenames:
             directory = os.path.dirname(filename)
-            if (
-                directory
-                and not os.path.exists(directory)
-                and directory not in new_directories
-            ):
-                new_directories.append(directory)
-        new_files = [
-            file for file in filenames if not pathlib.Path(output_dir, file).exists()
-        ]
-        existing_files = [
-            file for file in filenames if pathlib.Path(output_dir, file).exists()
-        ]
+            if directory and directory not in seen_directories:
+                seen_directories.add(directory)
+                if not os.path.exists(directory):
+                    new_directories.append(directory)
+            if os.path.normpath(filename) in existing:
+                existing_files.append(filename)
+            else:
+                new_files.append(filename)
         if new_directories:
             click.echo("The following directories will be created:")
             for directory in new_directories:
@@ -428,24 +666,54 @@ def save_dir(files: list[TextFile], output_dir: str, yes: bool = False) -> None:
         if new_files:
             click.echo("The following files will be created:")
             for file in new_files:
-                click.echo(f" {pathlib.Path(output_dir, file)}")
+                click.echo(f" {os.path.join(output_dir, file)}")
         if existing_files:
             click.echo("The following files will be overwritten:")
             for file in existing_files:
-                click.echo(f" {pathlib.Path(output_dir, file)}")
+                click.echo(f" {os.path.join(output_dir, file)}")
         click.echo("Continue? (y/n)")
         if input() != "y":
             click.echo("Aborted.")
             return
+    # Create parent directories serially (deduplicated) so the writes below
+    # never race on mkdir, and announce the files in a stable order.
+    # Duplicate paths keep only the last block (the old serial loop's
+    # last-write-wins), so the pool never writes one file concurrently; the
+    # key is normalized so spelling variants ('a.py', './a.py', 'x/../a.py')
+    # of one file dedupe together.
+    made_parents: set[str] = set()
+    targets: dict[str, Tuple[str, TextFile]] = {}
     for file in files:
-        click.echo(f"Writing {pathlib.Path(output_dir, file.path)}")
-        path = pathlib.Path(output_dir, file.path)
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, "w") as f:
-            f.write(file.text)
+        path = os.path.join(output_dir, file.path)
+        click.echo(f"Writing {path}")
+        parent = os.path.dirname(path)
+        if parent and parent not in made_parents:
+            os.makedirs(parent, exist_ok=True)
+            made_parents.add(parent)
+        targets[os.path.normpath(path)] = (path, file)
+
+    def _write_one(target: Tuple[str, TextFile]) -> None:
+        # Write the encoded bytes through the raw fd, skipping the buffered
+        # text layer; each file is one open/write/close.
+        path, file = target
+        data = file.text.encode("utf-8")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+        finally:
+            os.close(fd)
+
+    # File writes release the GIL, so a thread pool overlaps their latency.
+    if targets:
+        with ThreadPoolExecutor(max_workers=min(32, len(targets))) as executor:
+            list(executor.map(_write_one, targets.values()))
 
 
 def test_default_parser():
+    import textwrap
+
     md = textwrap.dedent(
         """
         ```python
@@ -466,12 +734,29 @@ def test_default_parser():
     assert list(default_parser(md).code_blocks) == expected
 
 
-@pytest.mark.parametrize("text_file, expected", [
-    (TextFile(text="x = 1\n", path="out.py"), "out.py\n\n```python\nx = 1\n```\n\n"),
-    (TextFile(text="let x = 1;\n", path="out.rs"), "out.rs\n\n```rust\nlet x = 1;\n```\n\n"),
-    ])
-def test_default_formatter(text_file: TextFile, expected: str) -> None:
-    assert default_formatter(text_file, path_location="below") == expected
+def test_default_parser_trailing_blank_line():
+    # A blank line before the closing fence does not survive into the body
+    # when the path comment is stripped.
+    md = "```python\n# t.py\nx = 1\n\n```\n"
+    assert default_parser(md).code_blocks[0].text == "x = 1"
+
+
+def test_md2dir_unclosed_block(tmp_path):
+    # The parser already drops the partial final line of an unclosed block;
+    # md2dir must write the complete lines before it untouched.
+    md = "```python\n# t.py\nkeep1 = 1\nkeep2 = 2\npartial = "
+    result = md2dir(md, output_dir=str(tmp_path), yes=True)
+    assert not result.last_code_block_is_unclosed
+    assert (tmp_path / "t.py").read_text() == "keep1 = 1\nkeep2 = 2"
+
+
+def test_default_formatter() -> None:
+    cases = [
+        (TextFile(text="x = 1\n", path="out.py"), "out.py\n\n```python\nx = 1\n```\n\n"),
+        (TextFile(text="let x = 1;\n", path="out.rs"), "out.rs\n\n```rust\nlet x = 1;\n```\n\n"),
+    ]
+    for text_file, expected in cases:
+        assert default_formatter(text_file, path_location="below") == expected
 
 
 def test_parse_file_arg():